@@ -1,14 +1,28 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
+import orjson
+import asyncio
+import heapq
+import io
+import itertools
 import os
-import json
 import threading
 import time
-from datetime import datetime
-from migration_engine import MigrationEngine
-from storage_checker import StorageChecker
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from .config import Config
+from .migration_engine import MigrationEngine
+from .storage_checker import StorageChecker
+from .utils import copy_stream, drop_page_cache, human_readable_size, utc_timestamp
 import logging
 
+try:
+    import fcntl  # Serialises log writes across gunicorn workers
+except ImportError:
+    fcntl = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,10 +30,27 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, static_folder='../frontend', template_folder='../frontend')
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+def dump_json(obj):
+    """Serialise to compact JSON bytes with orjson"""
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return dump_json(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = OrjsonProvider(app)
+
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024 * 1024  # 50GB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MIGRATION_LOG'] = 'migration_logs.json'
+app.config['MIGRATION_LOG'] = 'migration_logs.jsonl'
+app.config['LEGACY_MIGRATION_LOG'] = 'migration_logs.json'  # Pre-JSONL format, converted once
+app.config['MIGRATION_LOG_COMPACT_SIZE'] = 10 * 1024 * 1024  # Rewrite log past 10MB
 
 # Ensure directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -29,8 +60,27 @@ os.makedirs('logs', exist_ok=True)
 migration_engine = MigrationEngine()
 storage_checker = StorageChecker()
 
-# Active migrations tracker
+# Active migrations tracker; jobs are mutated in place, the lock guards membership
 active_migrations = {}
+active_migrations_lock = threading.RLock()
+
+# Wall-clock length of the simulated migration in run_migration
+SIMULATED_MIGRATION_SECONDS = 20
+
+# Logged (completed or failed) migrations, hydrated from the log at startup
+completed_migrations = {}
+migration_log_lock = threading.Lock()  # Guards completed_migrations and the read position
+migration_log_file_lock = threading.Lock()  # Serialises log writes within this process
+migration_log_position = {'inode': None, 'generation': None, 'offset': 0}
+migration_log_compaction = {'size': 0}
+
+# First line of a compacted log; tells rewrites apart even if the inode number is reused
+MIGRATION_LOG_HEADER = b'{"generation":'
+
+# Background event loop that runs all migration jobs
+migration_loop = asyncio.new_event_loop()
+migration_slots = asyncio.Semaphore(Config.MAX_CONCURRENT_MIGRATIONS)
+threading.Thread(target=migration_loop.run_forever, name='migration-loop', daemon=True).start()
 
 @app.route('/')
 def index():
@@ -43,7 +93,7 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'service': 'DataFlow AI Migration Service',
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': utc_timestamp()
     })
 
 @app.route('/api/check-storage', methods=['POST'])
@@ -117,36 +167,49 @@ def connect_device():
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Handle file uploads"""
+    saved_paths = []
+    used_names = set()
+    
+    # One timestamp for every file in the request
+    now = datetime.now(timezone.utc)
+    timestamp_prefix = now.strftime('%Y%m%d_%H%M%S')
+    uploaded_at = now.isoformat(timespec='seconds')
+    
+    def stream_factory(total_content_length, content_type, filename=None, content_length=None):
+        """Write each uploaded part straight to its final path instead of a temp file"""
+        if not filename:
+            return io.BytesIO()
+        
+        filepath, stream = open_upload(filename, timestamp_prefix, 'xb+', used_names)
+        saved_paths.append(filepath)
+        return stream
+    
     try:
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'error': 'No file provided'}), 400
+        parser = request.make_form_data_parser()
+        parser.stream_factory = stream_factory
+        _, _, files = parser.parse(
+            request.stream, request.mimetype, request.content_length, request.mimetype_params
+        )
         
-        files = request.files.getlist('file')
         file_info = []
         
-        for file in files:
-            if file.filename == '':
+        for field, file in files.items(multi=True):
+            stream = file.stream
+            if field != 'file' or file.filename == '':
+                stream.close()
+                if file.filename:
+                    discard_uploads([stream.name])
                 continue
             
-            # Generate unique filename
-            filename = f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
-            # Save file
-            file.save(filepath)
+            # Get file info from the already-open descriptor
+            file_size = os.fstat(stream.fileno()).st_size
+            drop_page_cache(stream)
+            stream.close()
             
-            # Get file info
-            file_size = os.path.getsize(filepath)
-            file_info.append({
-                'filename': filename,
-                'original_name': file.filename,
-                'size': file_size,
-                'size_human': human_readable_size(file_size),
-                'path': filepath,
-                'uploaded_at': datetime.utcnow().isoformat()
-            })
-            
-            logger.info(f"Uploaded: {filename} ({file_size} bytes)")
+            file_info.append(build_file_info(stream.name, file.filename, file_size, uploaded_at))
+        
+        if 'file' not in files:
+            return jsonify({'success': False, 'error': 'No file provided'}), 400
         
         return jsonify({
             'success': True,
@@ -156,6 +219,36 @@ def upload_file():
         })
         
     except Exception as e:
+        discard_uploads(saved_paths)
+        logger.error(f"Upload error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/upload/<name>', methods=['PUT'])
+def upload_raw_file(name):
+    """Handle a single file upload sent as the raw request body"""
+    filepath = None
+    try:
+        now = datetime.now(timezone.utc)
+        filepath, out = open_upload(name, now.strftime('%Y%m%d_%H%M%S'), 'xb')
+        
+        # Save file without multipart parsing or temp-file spooling
+        with out:
+            copy_stream(request.stream, out)
+            file_size = out.tell()  # Bytes written so far, no stat() needed
+            drop_page_cache(out)
+        
+        file_info = [build_file_info(filepath, name, file_size, now.isoformat(timespec='seconds'))]
+        
+        return jsonify({
+            'success': True,
+            'files': file_info,
+            'total_size': file_size,
+            'total_files': 1
+        })
+        
+    except Exception as e:
+        if filepath:
+            discard_uploads([filepath])
         logger.error(f"Upload error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -164,7 +257,7 @@ def start_migration():
     """Start a new migration job"""
     try:
         data = request.json
-        migration_id = f"mig_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"
+        migration_id = f"mig_{time.time_ns()}"
         
         logger.info(f"Starting migration {migration_id}: {data}")
         
@@ -177,20 +270,16 @@ def start_migration():
             'destination': data.get('destination'),
             'files': data.get('files', []),
             'settings': data.get('settings', {}),
-            'started_at': datetime.utcnow().isoformat(),
-            'last_update': datetime.utcnow().isoformat()
+            'started_at': utc_timestamp(),
+            'last_update': utc_timestamp()
         }
         
-        # Start migration in background thread
-        thread = threading.Thread(
-            target=run_migration,
-            args=(migration_job,)
-        )
-        thread.daemon = True
-        thread.start()
-        
         # Track active migration
-        active_migrations[migration_id] = migration_job
+        with active_migrations_lock:
+            active_migrations[migration_id] = migration_job
+        
+        # Schedule migration on the background event loop
+        asyncio.run_coroutine_threadsafe(run_migration(migration_job), migration_loop)
         
         return jsonify({
             'success': True,
@@ -209,12 +298,8 @@ def get_migration_status(migration_id):
     
     if not migration:
         # Check if it's in log
-        try:
-            with open(app.config['MIGRATION_LOG'], 'r') as f:
-                migrations = json.load(f)
-                migration = migrations.get(migration_id)
-        except:
-            migration = None
+        refresh_completed_migrations()
+        migration = completed_migrations.get(migration_id)
     
     if migration:
         return jsonify({
@@ -230,20 +315,27 @@ def get_migration_status(migration_id):
 @app.route('/api/get-migrations', methods=['GET'])
 def get_migrations():
     """Get list of all migrations"""
-    migrations_list = list(active_migrations.values())
-    
     # Add completed migrations from log
-    try:
-        with open(app.config['MIGRATION_LOG'], 'r') as f:
-            completed_migrations = json.load(f)
-            migrations_list.extend(completed_migrations.values())
-    except:
-        pass
+    refresh_completed_migrations()
+    with active_migrations_lock, migration_log_lock:
+        # Finished jobs stay active for an hour after being logged; list them once
+        migrations = itertools.chain(
+            active_migrations.values(),
+            (m for m in completed_migrations.values() if m['id'] not in active_migrations)
+        )
+        # Return last 50 migrations
+        migrations_list = heapq.nlargest(50, migrations, key=lambda m: m.get('started_at') or '')
     
-    return jsonify({
-        'success': True,
-        'migrations': migrations_list[:50]  # Return last 50 migrations
-    })
+    def generate():
+        """Serialise one migration at a time so the response starts immediately"""
+        yield b'{"success":true,"migrations":['
+        separator = b''
+        for migration in migrations_list:
+            yield separator + dump_json(migration)
+            separator = b','
+        yield b']}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @app.route('/api/analyze-files', methods=['POST'])
 def analyze_files():
@@ -264,83 +356,249 @@ def analyze_files():
         logger.error(f"Analysis error: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def run_migration(migration_job):
-    """Run migration in background thread"""
+async def run_migration(migration_job):
+    """Run migration on the background event loop"""
     try:
         migration_id = migration_job['id']
-        logger.info(f"Running migration {migration_id}")
-        
-        # Update status
-        migration_job['status'] = 'in_progress'
-        migration_job['progress'] = 10
         
-        # Simulate migration process (replace with actual migration logic)
-        for i in range(10, 101, 10):
-            time.sleep(2)  # Simulate work
-            
-            migration_job['progress'] = i
-            migration_job['last_update'] = datetime.utcnow().isoformat()
-            
-            # Update speed estimation
-            migration_job['current_speed'] = f"{50 + i} MB/s"
+        # Wait for a free migration slot
+        async with migration_slots:
+            logger.info(f"Running migration {migration_id}")
             
-            # Calculate estimated time remaining
-            if i < 100:
-                remaining_time = (100 - i) * 2  # 2 seconds per 10%
-                migration_job['eta_seconds'] = remaining_time
+            # Update status
+            migration_job['status'] = 'in_progress'
+            migration_job['progress'] = 10
             
-            # Save progress
-            active_migrations[migration_id] = migration_job
+            # Simulate migration process (replace with actual migration logic)
+            started = time.monotonic()
+            delay = 0.1
+            while migration_job['progress'] < 100:
+                elapsed = time.monotonic() - started
+                
+                # Poll quickly at first, then back off so long jobs heartbeat less often
+                await asyncio.sleep(min(delay, max(SIMULATED_MIGRATION_SECONDS - elapsed, 0)))
+                delay = min(delay * 1.5, 5.0)
+                
+                elapsed = time.monotonic() - started
+                progress = min(100, 10 + int(90 * elapsed / SIMULATED_MIGRATION_SECONDS))
+                if progress == migration_job['progress']:
+                    continue  # Only publish updates when progress moves
+                
+                migration_job['progress'] = progress
+                migration_job['last_update'] = utc_timestamp()
+                
+                # Update speed estimation
+                migration_job['current_speed'] = f"{50 + progress} MB/s"
+                
+                # Calculate estimated time remaining
+                if progress < 100:
+                    migration_job['eta_seconds'] = round(SIMULATED_MIGRATION_SECONDS - elapsed)
         
         # Mark as completed
         migration_job['status'] = 'completed'
-        migration_job['completed_at'] = datetime.utcnow().isoformat()
+        migration_job['completed_at'] = utc_timestamp()
         migration_job['progress'] = 100
         
-        # Log migration
-        log_migration(migration_job)
+        # Log migration; file locking can block, so keep it off the event loop
+        await migration_loop.run_in_executor(None, log_migration, migration_job)
         
         # Remove from active migrations after 1 hour
-        time.sleep(3600)
-        if migration_id in active_migrations:
-            del active_migrations[migration_id]
+        migration_loop.call_later(3600, forget_migration, migration_id)
             
         logger.info(f"Migration {migration_id} completed successfully")
         
     except Exception as e:
         migration_job['status'] = 'failed'
         migration_job['error'] = str(e)
-        migration_job['failed_at'] = datetime.utcnow().isoformat()
-        log_migration(migration_job)
+        migration_job['failed_at'] = utc_timestamp()
+        await migration_loop.run_in_executor(None, log_migration, migration_job)
         logger.error(f"Migration {migration_job['id']} failed: {str(e)}")
 
+def forget_migration(migration_id):
+    """Stop tracking a finished migration as active"""
+    with active_migrations_lock:
+        active_migrations.pop(migration_id, None)
+
 def log_migration(migration_job):
-    """Log migration to JSON file"""
+    """Append migration to the JSONL log; waits on the file lock, so run it off the event loop"""
     try:
-        migrations = {}
-        
-        # Load existing migrations
-        if os.path.exists(app.config['MIGRATION_LOG']):
-            with open(app.config['MIGRATION_LOG'], 'r') as f:
-                migrations = json.load(f)
+        line = dump_json(migration_job) + b'\n'
         
-        # Add/update migration
-        migrations[migration_job['id']] = migration_job
-        
-        # Save back
-        with open(app.config['MIGRATION_LOG'], 'w') as f:
-            json.dump(migrations, f, indent=2, default=str)
+        with locked_migration_log():
+            with open(app.config['MIGRATION_LOG'], 'ab') as f:
+                f.write(line)
+                log_size = f.tell()
+            
+            with migration_log_lock:
+                completed_migrations[migration_job['id']] = migration_job
+            
+            # Drop superseded entries once the log has doubled since the last rewrite
+            threshold = max(app.config['MIGRATION_LOG_COMPACT_SIZE'], 2 * migration_log_compaction['size'])
+            if log_size > threshold:
+                compact_migration_log()
             
     except Exception as e:
         logger.error(f"Failed to log migration: {str(e)}")
 
-def human_readable_size(size_bytes):
-    """Convert bytes to human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.2f} PB"
+def load_migration_log():
+    """Load logged migrations at startup, sealing off any line truncated by a crash"""
+    try:
+        with locked_migration_log():
+            convert_legacy_migration_log()
+            
+            log_path = app.config['MIGRATION_LOG']
+            if not os.path.exists(log_path):
+                return
+            
+            with migration_log_lock:
+                read_new_log_lines()
+            if os.path.getsize(log_path) > migration_log_position['offset']:
+                with open(log_path, 'a') as f:
+                    f.write('\n')
+    except Exception as e:
+        logger.error(f"Failed to load migration log: {str(e)}")
+
+@contextmanager
+def locked_migration_log():
+    """Hold the log file lock across threads and, where flock exists, across worker processes"""
+    with migration_log_file_lock:
+        if fcntl is None:
+            yield
+            return
+        
+        # Lock a sidecar file; the log itself is replaced on compaction
+        with open(app.config['MIGRATION_LOG'] + '.lock', 'ab') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield  # Released when the lock file is closed
+
+def convert_legacy_migration_log():
+    """Carry history from the old single-object JSON log over into the JSONL log"""
+    legacy_path = app.config['LEGACY_MIGRATION_LOG']
+    log_path = app.config['MIGRATION_LOG']
+    if not os.path.exists(legacy_path) or os.path.exists(log_path):
+        return
+    
+    try:
+        with open(legacy_path, 'rb') as f:
+            migrations = orjson.loads(f.read())
+        
+        tmp_path = log_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for migration in migrations.values():
+                f.write(dump_json(migration) + b'\n')
+        os.replace(tmp_path, log_path)
+        logger.info(f"Converted {len(migrations)} migrations from {legacy_path}")
+    except Exception as e:
+        logger.error(f"Failed to convert legacy migration log: {str(e)}")
+
+def refresh_completed_migrations():
+    """Read only the log lines appended since the last refresh; later lines win"""
+    try:
+        stat = os.stat(app.config['MIGRATION_LOG'])
+    except FileNotFoundError:
+        return
+    
+    position = migration_log_position
+    if stat.st_ino == position['inode'] and stat.st_size == position['offset']:
+        return  # Nothing new since the last read
+    
+    try:
+        with migration_log_lock:
+            read_new_log_lines()
+    except Exception as e:
+        logger.error(f"Failed to load migration log: {str(e)}")
+
+def read_new_log_lines():
+    """Apply log lines past the last read position (caller holds migration_log_lock)"""
+    position = migration_log_position
+    with open(app.config['MIGRATION_LOG'], 'rb') as f:
+        stat = os.fstat(f.fileno())
+        first_line = f.readline()
+        generation = first_line if first_line.startswith(MIGRATION_LOG_HEADER) else None
+        if (stat.st_ino != position['inode'] or generation != position['generation']
+                or stat.st_size < position['offset']):
+            position['offset'] = 0  # Log was compacted or replaced
+        
+        f.seek(position['offset'])
+        for line in f:
+            if not line.endswith(b'\n'):
+                break  # Incomplete line, pick it up once finished
+            position['offset'] += len(line)
+            if line.startswith(MIGRATION_LOG_HEADER):
+                continue
+            
+            try:
+                migration = orjson.loads(line)
+            except ValueError:
+                continue  # Skip lines truncated by a crash
+            completed_migrations[migration['id']] = migration
+        
+        position['inode'] = stat.st_ino
+        position['generation'] = generation
+
+def compact_migration_log():
+    """Rewrite the log with one line per migration (caller holds locked_migration_log)"""
+    log_path = app.config['MIGRATION_LOG']
+    tmp_path = log_path + '.tmp'
+    try:
+        with migration_log_lock:
+            # Take in other workers' lines first so the rewrite keeps them
+            read_new_log_lines()
+            migrations = list(completed_migrations.values())
+        
+        # Appends wait on the file lock meanwhile; status reads only need migration_log_lock
+        with open(tmp_path, 'wb') as f:
+            f.write(dump_json({'generation': os.urandom(8).hex()}) + b'\n')
+            for migration in migrations:
+                f.write(dump_json(migration) + b'\n')
+            compacted_size = f.tell()
+        
+        os.replace(tmp_path, log_path)
+        migration_log_compaction['size'] = compacted_size
+    except Exception as e:
+        logger.error(f"Failed to compact migration log: {str(e)}")
+
+def open_upload(filename, timestamp_prefix, mode, used_names=None):
+    """Create a new upload file, numbering the name until it is free in the request and on disk"""
+    name = secure_filename(filename) or 'upload'
+    stem, ext = os.path.splitext(name)
+    for repeat in itertools.count():
+        candidate = f"{stem}_{repeat}{ext}" if repeat else name
+        if used_names is not None:
+            if candidate in used_names:
+                continue
+            used_names.add(candidate)
+        
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp_prefix}_{candidate}")
+        try:
+            return filepath, open(filepath, mode)
+        except FileExistsError:
+            continue  # Taken by another upload in the same second
+
+def build_file_info(filepath, original_name, file_size, uploaded_at):
+    """Describe a file that has been written to the upload folder"""
+    filename = os.path.basename(filepath)
+    logger.info(f"Uploaded: {filename} ({file_size} bytes)")
+    return {
+        'filename': filename,
+        'original_name': original_name,
+        'size': file_size,
+        'size_human': human_readable_size(file_size),
+        'path': filepath,
+        'uploaded_at': uploaded_at
+    }
+
+def discard_uploads(filepaths):
+    """Remove partially written or unused upload files"""
+    for filepath in filepaths:
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+
+# Hydrate logged migrations once at startup
+load_migration_log()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Local development server only (run as `python -m backend.app`); production is served by gunicorn (see Procfile)
+    app.run(host='0.0.0.0', port=5000, debug=os.getenv('FLASK_ENV') == 'development')
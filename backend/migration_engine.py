@@ -1,17 +1,79 @@
+import errno
 import os
 import json
 import hashlib
+import itertools
+import mmap
+import shutil
+from bisect import bisect_right
 from datetime import datetime
 from typing import Dict, List, Any
 import logging
+from .utils import human_readable_size
 
 logger = logging.getLogger(__name__)
 
+MB = 1 << 20
+GB = 1 << 30
+
+# File types that shrink well under general-purpose compression
+COMPRESSIBLE = frozenset(('txt', 'csv', 'json', 'xml', 'log', 'html', 'css', 'js'))
+
+# File types listed as worth compressing before transfer
+_COMPRESSIBLE_EXTENSIONS = COMPRESSIBLE | {'doc', 'docx', 'pdf'}
+
+SUPPORTED_DATABASES = ('mysql', 'postgresql', 'mongodb', 'sqlite', 'oracle', 'sqlserver')
+SUPPORTED_DEVICES = ('phone', 'computer', 'server', 'nas', 'cloud')
+
+# Endpoint type -> scoring category; anything unlisted is 'other'
+_TYPE_CATEGORIES = {
+    **{t: 'database' for t in SUPPORTED_DATABASES},
+    **{t: 'device' for t in SUPPORTED_DEVICES},
+}
+
+def _compatibility_deduction(source_category: str, dest_category: str, same_type: bool,
+                             os_differs: bool, protocol_differs: bool) -> int:
+    """Score deduction for one combination of migration traits"""
+    deduction = 0
+    
+    # Unsupported source or destination type
+    if source_category == 'other':
+        deduction += 30
+    if dest_category == 'other':
+        deduction += 30
+    
+    # Different database systems
+    if source_category == dest_category == 'database' and not same_type:
+        deduction += 20
+    
+    # Cross-platform considerations
+    if os_differs:
+        deduction += 10
+    
+    # Connection protocol compatibility
+    if protocol_differs:
+        deduction += 15
+    
+    return deduction
+
+# Every trait combination is scored once at import; check_compatibility does one lookup
+_COMPATIBILITY_DEDUCTIONS = {
+    key: _compatibility_deduction(*key)
+    for key in itertools.product(
+        ('database', 'device', 'other'), ('database', 'device', 'other'),
+        (True, False), (True, False), (True, False)
+    )
+}
+
+# Batch size by total transfer size: (upper bound, batch size)
+_BATCH_SIZE_THRESHOLDS = (1 * GB, 10 * GB)
+_BATCH_SIZES = (100 * MB, 500 * MB, 1 * GB)
+
 class MigrationEngine:
     def __init__(self):
         self.supported_formats = {
-            'databases': ['mysql', 'postgresql', 'mongodb', 'sqlite', 'oracle', 'sqlserver'],
-            'devices': ['phone', 'computer', 'server', 'nas', 'cloud'],
+            'databases': list(SUPPORTED_DATABASES),
+            'devices': list(SUPPORTED_DEVICES),
             'file_types': ['*']  # All file types supported
         }
     
@@ -19,32 +81,16 @@ class MigrationEngine:
         """Check compatibility between source and destination"""
         source_type = source.get('type')
         dest_type = destination.get('type')
+        source_os = source.get('os')
+        dest_os = destination.get('os')
         
-        compatibility_score = 100  # Start with perfect score
-        
-        # Check if types are supported
-        if source_type not in self.supported_formats['devices'] + self.supported_formats['databases']:
-            compatibility_score -= 30
-            
-        if dest_type not in self.supported_formats['devices'] + self.supported_formats['databases']:
-            compatibility_score -= 30
-        
-        # Database to database migration
-        if source_type in self.supported_formats['databases'] and dest_type in self.supported_formats['databases']:
-            if source_type != dest_type:
-                compatibility_score -= 20  # Different database systems
-        
-        # Cross-platform considerations
-        if source.get('os') and destination.get('os'):
-            if source['os'] != destination['os']:
-                compatibility_score -= 10
-        
-        # Connection protocol compatibility
-        source_protocol = source.get('protocol', 'file')
-        dest_protocol = destination.get('protocol', 'file')
-        
-        if source_protocol != dest_protocol:
-            compatibility_score -= 15
+        compatibility_score = 100 - _COMPATIBILITY_DEDUCTIONS[(
+            _TYPE_CATEGORIES.get(source_type, 'other'),
+            _TYPE_CATEGORIES.get(dest_type, 'other'),
+            source_type == dest_type,
+            bool(source_os and dest_os and source_os != dest_os),
+            source.get('protocol', 'file') != destination.get('protocol', 'file')
+        )]
         
         return {
             'compatible': compatibility_score >= 70,
@@ -92,9 +138,13 @@ class MigrationEngine:
         """Analyze files for migration optimization"""
         total_size = 0
         file_types = {}
-        largest_file = {'name': '', 'size': 0}
+        largest_name, largest_size = '', 0
         compressible_files = []
         
+        # Bind hot lookups once; this loop runs per manifest entry
+        get_type_size = file_types.get
+        add_compressible = compressible_files.append
+        
         for file_info in files:
             size = file_info.get('size', 0)
             total_size += size
@@ -102,16 +152,18 @@ class MigrationEngine:
             # Track file types
             filename = file_info.get('filename', '')
             if '.' in filename:
-                ext = filename.split('.')[-1].lower()
-                file_types[ext] = file_types.get(ext, 0) + size
+                ext = filename.rpartition('.')[2].lower()
+                file_types[ext] = get_type_size(ext, 0) + size
+                
+                # Check if file is compressible
+                if ext in _COMPRESSIBLE_EXTENSIONS:
+                    add_compressible(filename)
             
             # Find largest file
-            if size > largest_file['size']:
-                largest_file = {'name': filename, 'size': size}
-            
-            # Check if file is compressible
-            if self._is_compressible(filename):
-                compressible_files.append(filename)
+            if size > largest_size:
+                largest_name, largest_size = filename, size
+        
+        largest_file = {'name': largest_name, 'size': largest_size}
         
         # Calculate compression estimation
         estimated_compression = self._estimate_compression(file_types)
@@ -119,7 +171,7 @@ class MigrationEngine:
         return {
             'total_files': len(files),
             'total_size': total_size,
-            'total_size_human': self._human_readable_size(total_size),
+            'total_size_human': human_readable_size(total_size),
             'file_types': file_types,
             'largest_file': largest_file,
             'compressible_files': compressible_files,
@@ -128,23 +180,14 @@ class MigrationEngine:
             'recommended_batch_size': self._calculate_batch_size(total_size, len(files))
         }
     
-    def _is_compressible(self, filename: str) -> bool:
-        """Check if file type is compressible"""
-        compressible_extensions = ['txt', 'csv', 'json', 'xml', 'log', 'html', 'css', 'js', 'doc', 'docx', 'pdf']
-        if '.' in filename:
-            ext = filename.split('.')[-1].lower()
-            return ext in compressible_extensions
-        return False
-    
     def _estimate_compression(self, file_types: Dict) -> float:
         """Estimate compression ratio based on file types"""
         total_compressible = 0
-        total_size = sum(file_types.values())
-        
-        compressible_types = ['txt', 'csv', 'json', 'xml', 'log', 'html', 'css', 'js']
+        total_size = 0
         
         for ext, size in file_types.items():
-            if ext in compressible_types:
+            total_size += size
+            if ext in COMPRESSIBLE:
                 total_compressible += size
         
         if total_size == 0:
@@ -157,19 +200,15 @@ class MigrationEngine:
     
     def _calculate_batch_size(self, total_size: int, file_count: int) -> Dict:
         """Calculate optimal batch size for migration"""
-        if total_size < 1024 * 1024 * 100:  # Less than 100MB
+        if total_size < 100 * MB:
             return {'size': total_size, 'files': file_count, 'batches': 1}
         
-        # Calculate based on size
-        if total_size < 1024 * 1024 * 1024:  # Less than 1GB
-            batch_size = 1024 * 1024 * 100  # 100MB batches
-        elif total_size < 1024 * 1024 * 1024 * 10:  # Less than 10GB
-            batch_size = 1024 * 1024 * 500  # 500MB batches
-        else:
-            batch_size = 1024 * 1024 * 1024  # 1GB batches
+        # Calculate based on size: 100MB batches under 1GB, 500MB under 10GB, else 1GB
+        batch_size = _BATCH_SIZES[bisect_right(_BATCH_SIZE_THRESHOLDS, total_size)]
         
-        batches = max(1, total_size // batch_size)
-        files_per_batch = max(1, file_count // batches)
+        # total_size >= 100MB >= batch_size here, so there is always at least one batch
+        batches = total_size // batch_size
+        files_per_batch = file_count // batches or 1
         
         return {
             'size_per_batch': batch_size,
@@ -188,11 +227,11 @@ class MigrationEngine:
         batch_info = analysis.get('recommended_batch_size', {})
         
         # Size-based recommendations
-        if total_size > 1024 * 1024 * 1024 * 5:  # More than 5GB
+        if total_size > 5 * GB:
             recommendations.append("Large dataset detected. Consider migrating during off-peak hours")
             recommendations.append("Enable compression to reduce transfer size")
         
-        elif total_size < 1024 * 1024 * 10:  # Less than 10MB
+        elif total_size < 10 * MB:
             recommendations.append("Small dataset. Single transfer recommended for efficiency")
         
         # File count recommendations
@@ -214,21 +253,48 @@ class MigrationEngine:
         
         return recommendations
     
-    def _human_readable_size(self, size_bytes: int) -> str:
-        """Convert bytes to human readable format"""
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f} PB"
-    
     def calculate_checksum(self, filepath: str) -> str:
-        """Calculate MD5 checksum for a file"""
-        hash_md5 = hashlib.md5()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        """Calculate SHA-256 checksum for a file"""
+        with open(filepath, "rb", buffering=0) as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OverflowError, OSError):
+                pass  # Empty, unmappable or too large for the address space
+            else:
+                with mapped:
+                    # Read ahead aggressively and drop pages once hashed
+                    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    # One C call over the whole file; hashlib releases the GIL while hashing
+                    return hashlib.sha256(mapped).hexdigest()
+            
+            if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+                return hashlib.file_digest(f, 'sha256').hexdigest()
+            
+            hash_sha256 = hashlib.sha256()
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hash_sha256.update(chunk)
+            return hash_sha256.hexdigest()
+    
+    def copy_file(self, src_path: str, dst_path: str) -> int:
+        """Copy a file between local mounts without passing the data through Python"""
+        if hasattr(os, 'copy_file_range'):  # Linux
+            try:
+                with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+                    copied = 0
+                    while True:
+                        n = os.copy_file_range(src.fileno(), dst.fileno(), GB)
+                        if n == 0:
+                            return copied
+                        copied += n
+            except OSError as e:
+                # Unsupported kernel or filesystem pair; use the fallback below
+                if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+        
+        # shutil uses sendfile on Linux, fcopyfile on macOS and a buffered copy elsewhere
+        shutil.copyfile(src_path, dst_path)
+        return os.path.getsize(dst_path)
     
     def estimate_migration_time(self, total_size: int, connection_speed: float = 50) -> Dict:
         """Estimate migration time based on size and connection speed"""
@@ -1,52 +1,239 @@
 import psutil
 import os
 import json
-from typing import Dict, List, Any
+import queue
+import threading
+import time
+from collections import namedtuple
+from dataclasses import dataclass
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Dict, Iterator, List, Any, Optional, Tuple
 import logging
+from .utils import human_readable_size
 
 logger = logging.getLogger(__name__)
 
+# Pseudo, image and network mounts skipped when listing system storage
+_SKIP_FSTYPES = frozenset({
+    'squashfs', 'tmpfs', 'devtmpfs', 'autofs', 'fuse.gvfsd-fuse', 'nfs', 'cifs'
+})
+# A tuple so str.startswith checks every prefix in one C call
+_SKIP_MOUNT_PREFIXES = ('/snap/', '/run/', '/var/lib/docker/')
+
+# Per-call budget for reading all partitions in get_system_storage
+PARTITION_PROBE_TIMEOUT = 2.0
+PARTITION_PROBE_WORKERS = 8
+
+# Shared probe workers, started on first use and reused across calls
+_probe_queue = queue.SimpleQueue()
+_probe_workers = []
+_probe_workers_lock = threading.Lock()
+_pending_probes = {}  # Latest probe per mountpoint
+
+# Disk usage moves slowly; reuse each path's reading for a couple of seconds
+DISK_USAGE_TTL = 2.0
+_DISK_USAGE_CACHE_MAX = 256
+_disk_usage_cache = {}
+
+# Same fields as psutil.disk_usage() results
+Usage = namedtuple('Usage', 'total used free percent')
+
+def _disk_usage(path: str) -> Any:
+    """Read disk usage for a path, calling statvfs directly on POSIX"""
+    if not hasattr(os, 'statvfs'):
+        return psutil.disk_usage(path)
+    
+    # Same figures psutil derives from statvfs, minus its wrapper overhead
+    st = os.statvfs(path)
+    total = st.f_blocks * st.f_frsize
+    free = st.f_bavail * st.f_frsize  # Available to unprivileged users
+    used = total - st.f_bfree * st.f_frsize
+    usable = used + free  # Excludes root-reserved blocks
+    percent = round(used / usable * 100, 1) if usable else 0.0
+    return Usage(total, used, free, percent)
+
+def _probe_worker() -> None:
+    """Run queued probes forever; a daemon thread, so a hung mount never blocks exit"""
+    while True:
+        future, fn, arg = _probe_queue.get()
+        if not future.set_running_or_notify_cancel():
+            continue  # Caller gave up before the probe started
+        try:
+            future.set_result(fn(arg))
+        except BaseException as e:
+            future.set_exception(e)
+
+def _submit_probe(key: str, fn, arg) -> Future:
+    """Queue fn(arg) on the shared probe workers, reusing an unfinished probe for the same key"""
+    with _probe_workers_lock:
+        if not _probe_workers:
+            for i in range(PARTITION_PROBE_WORKERS):
+                worker = threading.Thread(target=_probe_worker, name=f'partition-probe-{i}', daemon=True)
+                worker.start()
+                _probe_workers.append(worker)
+        
+        # A hung mount keeps its one stuck probe instead of taking a new worker every call
+        future = _pending_probes.get(key)
+        if future is not None and not future.done():
+            return future
+        
+        future = Future()
+        _pending_probes[key] = future
+    
+    _probe_queue.put((future, fn, arg))
+    return future
+
+def _cached_disk_usage(path: str) -> Any:
+    """_disk_usage with a short per-path TTL cache"""
+    now = time.monotonic()
+    cached = _disk_usage_cache.get(path)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    usage = _disk_usage(path)
+    
+    # Paths come from requests; keep the cache from growing without bound
+    if len(_disk_usage_cache) >= _DISK_USAGE_CACHE_MAX:
+        _disk_usage_cache.clear()
+    _disk_usage_cache[path] = (now + DISK_USAGE_TTL, usage)
+    return usage
+
+# Simulate 128GB device with 35% used
+_EXTERNAL_TOTAL = 128 << 30
+_EXTERNAL_USED = _EXTERNAL_TOTAL * 35 // 100
+_SIMULATED_EXTERNAL_USAGE = Usage(_EXTERNAL_TOTAL, _EXTERNAL_USED, _EXTERNAL_TOTAL - _EXTERNAL_USED, 35.0)
+
+# Simulate 500GB database with 42% used
+_DATABASE_TOTAL = 500 << 30
+_DATABASE_USED = _DATABASE_TOTAL * 42 // 100
+_SIMULATED_DATABASE_USAGE = Usage(_DATABASE_TOTAL, _DATABASE_USED, _DATABASE_TOTAL - _DATABASE_USED, 42.0)
+
+# (predicate(source_check, dest_check, compatibility), message), in output order
+_RECOMMENDATION_RULES = (
+    # Source recommendations
+    (lambda src, dst, compat: src.get('status') == 'critical',
+     "Source storage is critically full. Consider cleaning up before migration"),
+    (lambda src, dst, compat: src.get('status') == 'warning',
+     "Source storage is getting full. Monitor usage during migration"),
+    
+    # Destination recommendations
+    (lambda src, dst, compat: not dst.get('fits', False),
+     "Destination has insufficient space. Free up space or choose another destination"),
+    (lambda src, dst, compat: dst.get('fits', False) and not dst.get('fits_with_margin', False),
+     "Destination will have limited space after migration. Consider cleaning up destination first"),
+    (lambda src, dst, compat: dst.get('status') == 'critical',
+     "Destination storage is critically full. Not recommended for migration"),
+    (lambda src, dst, compat: dst.get('status') == 'warning',
+     "Destination storage is getting full. Consider alternative storage"),
+    
+    # Compatibility-based recommendations
+    (lambda src, dst, compat: not compat.get('compatible', False),
+     "Compatibility issues detected. Consider data conversion before migration"),
+)
+
+_GENERAL_RECOMMENDATIONS = (
+    "Always verify data integrity after migration",
+    "Keep backups of important data before migration",
+)
+
+def _format_size(size_bytes: float) -> str:
+    """Convert bytes to human readable format, showing negative sizes as zero"""
+    if size_bytes < 0:
+        return "0 B"
+    
+    return human_readable_size(size_bytes)
+
+@dataclass
+class CapacityResult:
+    """Numeric outcome of a capacity check; sizes are formatted only in to_dict"""
+    status: str
+    total: int = 0
+    used: int = 0
+    free: int = 0
+    percent_used: float = 0.0
+    required: int = 0
+    fits: bool = False
+    fits_with_margin: bool = False
+    error: Optional[str] = None
+    
+    @property
+    def available_after(self) -> int:
+        """Free space left once the required size is written"""
+        return self.free - self.required
+    
+    def to_dict(self, include_human: bool = True) -> Dict:
+        """Render as the check_capacity API dict, optionally with *_human strings"""
+        if self.error is not None:
+            return {
+                'status': 'error',
+                'error': self.error,
+                'fits': False,
+                'fits_with_margin': False
+            }
+        
+        result = {'status': self.status}
+        for key, value in (('total', self.total), ('used', self.used), ('free', self.free)):
+            result[f'{key}_bytes'] = value
+            if include_human:
+                result[f'{key}_human'] = _format_size(value)
+        
+        result['percent_used'] = self.percent_used
+        result['fits'] = self.fits
+        result['fits_with_margin'] = self.fits_with_margin
+        result['required_bytes'] = self.required
+        if include_human:
+            result['required_human'] = _format_size(self.required)
+        result['available_after_migration'] = self.available_after
+        if include_human:
+            result['available_after_human'] = _format_size(self.available_after)
+        
+        return result
+
 class StorageChecker:
     def __init__(self):
         self.threshold_warning = 0.85  # 85% usage threshold for warning
         self.threshold_critical = 0.95  # 95% usage threshold for critical
+        
+        # Whole-percent forms of the thresholds for integer comparisons
+        self._warning_percent = round(self.threshold_warning * 100)
+        self._critical_percent = round(self.threshold_critical * 100)
+        
+        # Usage source per device type; unknown types read the local root
+        self._usage_handlers = {
+            'local': self._usage_local,
+            'phone': self._simulate_external_storage,
+            'external': self._simulate_external_storage,
+            'database': self._check_database_storage
+        }
     
     def check_capacity(self, device_info: Dict, required_size: int = 0) -> Dict:
         """Check storage capacity for a device"""
+        return self._capacity_raw(device_info, required_size).to_dict()
+    
+    def _capacity_raw(self, device_info: Dict, required_size: int = 0) -> 'CapacityResult':
+        """Check storage capacity for a device without formatting any sizes"""
         device_type = device_info.get('type', 'unknown')
-        path = device_info.get('path', '/')
         
         try:
-            if device_type == 'local':
-                # Check local storage
-                usage = psutil.disk_usage(path)
-            elif device_type in ['phone', 'external']:
-                # For external devices, simulate or use specific checks
-                usage = self._simulate_external_storage(device_info)
-            elif device_type == 'database':
-                # For databases, check database storage
-                usage = self._check_database_storage(device_info)
-            else:
-                # Default to local storage
-                usage = psutil.disk_usage('/')
+            usage = self._usage_handlers.get(device_type, self._usage_default)(device_info)
             
             # Calculate available space
             total = usage.total
             used = usage.used
             free = usage.free
-            percent_used = usage.percent / 100
             
             # Check if required size fits
             fits = free >= required_size
             
             # Calculate safety margin (keep at least 10% free)
-            safety_margin = total * 0.1
+            safety_margin = total // 10
             fits_with_margin = free - required_size >= safety_margin
             
-            # Determine status
-            if percent_used >= self.threshold_critical:
+            # Determine status; usage is used / (used + free), as psutil reports it
+            usable = (used + free) or 1
+            if used * 100 >= usable * self._critical_percent:
                 status = 'critical'
-            elif percent_used >= self.threshold_warning:
+            elif used * 100 >= usable * self._warning_percent:
                 status = 'warning'
             elif not fits:
                 status = 'insufficient'
@@ -55,84 +242,75 @@ class StorageChecker:
             else:
                 status = 'healthy'
             
-            return {
-                'status': status,
-                'total_bytes': total,
-                'total_human': self._human_readable_size(total),
-                'used_bytes': used,
-                'used_human': self._human_readable_size(used),
-                'free_bytes': free,
-                'free_human': self._human_readable_size(free),
-                'percent_used': percent_used,
-                'fits': fits,
-                'fits_with_margin': fits_with_margin,
-                'required_bytes': required_size,
-                'required_human': self._human_readable_size(required_size),
-                'available_after_migration': free - required_size,
-                'available_after_human': self._human_readable_size(free - required_size)
-            }
+            return CapacityResult(
+                status=status,
+                total=total,
+                used=used,
+                free=free,
+                percent_used=usage.percent / 100,
+                required=required_size,
+                fits=fits,
+                fits_with_margin=fits_with_margin
+            )
             
         except Exception as e:
             logger.error(f"Storage check failed: {str(e)}")
-            return {
-                'status': 'error',
-                'error': str(e),
-                'fits': False,
-                'fits_with_margin': False
-            }
+            return CapacityResult(status='error', error=str(e))
+    
+    def _usage_local(self, device_info: Dict) -> Any:
+        """Check local storage at the device path"""
+        return _cached_disk_usage(device_info.get('path', '/'))
+    
+    def _usage_default(self, device_info: Dict) -> Any:
+        """Default to local storage at the filesystem root"""
+        return _cached_disk_usage('/')
     
     def _simulate_external_storage(self, device_info: Dict) -> Any:
         """Simulate external storage check"""
         # In production, implement actual device detection
         # For simulation, return realistic values
-        class Usage:
-            def __init__(self):
-                # Simulate 128GB device with 35% used
-                self.total = 128 * 1024 * 1024 * 1024
-                self.used = self.total * 0.35
-                self.free = self.total - self.used
-                self.percent = 35.0
-        
-        return Usage()
+        return _SIMULATED_EXTERNAL_USAGE
     
     def _check_database_storage(self, device_info: Dict) -> Any:
         """Check database storage"""
         # In production, connect to database and check storage
         # For simulation, return realistic values
-        class Usage:
-            def __init__(self):
-                # Simulate 500GB database with 42% used
-                self.total = 500 * 1024 * 1024 * 1024
-                self.used = self.total * 0.42
-                self.free = self.total - self.used
-                self.percent = 42.0
-        
-        return Usage()
+        return _SIMULATED_DATABASE_USAGE
     
-    def compare_storage(self, source_info: Dict, dest_info: Dict, data_size: int) -> Dict:
-        """Compare storage between source and destination"""
-        source_check = self.check_capacity(source_info, 0)  # Don't check required size for source
-        dest_check = self.check_capacity(dest_info, data_size)
+    def compare_storage(self, source_info: Dict, dest_info: Dict, data_size: int,
+                        probe_source_when_healthy: bool = True) -> Dict:
+        """Compare storage between source and destination
+        
+        With probe_source_when_healthy=False the source is only probed when the
+        destination is not healthy; otherwise 'source' is {'status': 'not_checked'}.
+        """
+        dest_result = self._capacity_raw(dest_info, data_size)
         
+        # The source only feeds a warning, so probing it is optional for a healthy destination
+        if probe_source_when_healthy or dest_result.status != 'healthy':
+            source_result = self._capacity_raw(source_info, 0)  # Don't check required size for source
+        else:
+            source_result = None
+        
+        # Decide on the raw numbers; sizes are formatted only for the response
+        size_difference = dest_result.free - data_size
         comparison = {
-            'source': source_check,
-            'destination': dest_check,
-            'can_migrate': dest_check.get('fits', False),
-            'can_migrate_safely': dest_check.get('fits_with_margin', False),
-            'size_difference': dest_check.get('free_bytes', 0) - data_size,
-            'size_difference_human': self._human_readable_size(
-                dest_check.get('free_bytes', 0) - data_size
-            )
+            'source': source_result.to_dict() if source_result else {'status': 'not_checked'},
+            'destination': dest_result.to_dict(),
+            'can_migrate': dest_result.fits,
+            'can_migrate_safely': dest_result.fits_with_margin,
+            'size_difference': size_difference,
+            'size_difference_human': self._human_readable_size(size_difference)
         }
         
         # Add warnings if needed
         warnings = []
-        if not comparison['can_migrate']:
+        if not dest_result.fits:
             warnings.append("Destination has insufficient space for migration")
-        elif not comparison['can_migrate_safely']:
+        elif not dest_result.fits_with_margin:
             warnings.append("Destination will have less than 10% free space after migration")
         
-        if source_check.get('status') == 'critical':
+        if source_result and source_result.status == 'critical':
             warnings.append("Source storage is critically full")
         
         comparison['warnings'] = warnings
@@ -141,82 +319,97 @@ class StorageChecker:
     
     def get_recommendations(self, source_check: Dict, dest_check: Dict, compatibility: Dict) -> List[str]:
         """Get storage recommendations"""
-        recommendations = []
-        
-        # Source recommendations
-        if source_check.get('status') == 'critical':
-            recommendations.append("Source storage is critically full. Consider cleaning up before migration")
-        elif source_check.get('status') == 'warning':
-            recommendations.append("Source storage is getting full. Monitor usage during migration")
-        
-        # Destination recommendations
-        if not dest_check.get('fits', False):
-            recommendations.append("Destination has insufficient space. Free up space or choose another destination")
-        elif not dest_check.get('fits_with_margin', False):
-            recommendations.append("Destination will have limited space after migration. Consider cleaning up destination first")
-        
-        if dest_check.get('status') == 'critical':
-            recommendations.append("Destination storage is critically full. Not recommended for migration")
-        elif dest_check.get('status') == 'warning':
-            recommendations.append("Destination storage is getting full. Consider alternative storage")
-        
-        # Compatibility-based recommendations
-        if not compatibility.get('compatible', False):
-            recommendations.append("Compatibility issues detected. Consider data conversion before migration")
-        
-        # General recommendations
-        recommendations.append("Always verify data integrity after migration")
-        recommendations.append("Keep backups of important data before migration")
-        
+        recommendations = [
+            message for applies, message in _RECOMMENDATION_RULES
+            if applies(source_check, dest_check, compatibility)
+        ]
+        recommendations.extend(_GENERAL_RECOMMENDATIONS)
         return recommendations
     
     def _human_readable_size(self, size_bytes: int) -> str:
         """Convert bytes to human readable format"""
-        if size_bytes < 0:
-            return "0 B"
+        return _format_size(size_bytes)
+    
+    def _probe_partition(self, partition: Any) -> Any:
+        """Get usage for one partition, or None if it can't be read"""
+        try:
+            return _cached_disk_usage(partition.mountpoint)
+        except Exception as e:
+            logger.error(f"Failed to get partition info for {partition.mountpoint}: {str(e)}")
+            return None
+    
+    def _iter_partitions(self) -> Iterator[Tuple[Any, Any]]:
+        """Yield (partition, usage) for each readable mount, in mount order"""
+        # Skip mounts whose statfs is slow or meaningless for migrations
+        mounts = [
+            partition for partition in psutil.disk_partitions(all=False)
+            if partition.fstype and partition.fstype not in _SKIP_FSTYPES
+            and not partition.mountpoint.startswith(_SKIP_MOUNT_PREFIXES)
+        ]
         
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f} PB"
+        # disk_usage blocks in a syscall without the GIL, so probe mounts concurrently
+        futures = [
+            (partition, _submit_probe(partition.mountpoint, self._probe_partition, partition))
+            for partition in mounts
+        ]
+        deadline = time.monotonic() + PARTITION_PROBE_TIMEOUT
+        
+        for partition, future in futures:
+            try:
+                usage = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except FuturesTimeoutError:
+                logger.warning(f"Timed out getting partition info for {partition.mountpoint}")
+                continue
+            
+            if usage is not None:
+                yield partition, usage
+    
+    def _storage_totals(self, total_space: int, total_used: int, total_free: int) -> Dict:
+        """Summarise accumulated partition sizes"""
+        return {
+            'total': total_space,
+            'total_human': self._human_readable_size(total_space),
+            'used': total_used,
+            'used_human': self._human_readable_size(total_used),
+            'free': total_free,
+            'free_human': self._human_readable_size(total_free),
+            'percent': (total_used / total_space * 100) if total_space > 0 else 0
+        }
     
     def get_system_storage(self) -> Dict:
         """Get system storage information"""
         partitions = []
+        total_space = total_used = total_free = 0
         
-        for partition in psutil.disk_partitions():
-            try:
-                usage = psutil.disk_usage(partition.mountpoint)
-                partitions.append({
-                    'device': partition.device,
-                    'mountpoint': partition.mountpoint,
-                    'fstype': partition.fstype,
-                    'total': usage.total,
-                    'total_human': self._human_readable_size(usage.total),
-                    'used': usage.used,
-                    'used_human': self._human_readable_size(usage.used),
-                    'free': usage.free,
-                    'free_human': self._human_readable_size(usage.free),
-                    'percent': usage.percent
-                })
-            except Exception as e:
-                logger.error(f"Failed to get partition info for {partition.mountpoint}: {str(e)}")
-        
-        # Calculate totals
-        total_space = sum(p['total'] for p in partitions)
-        total_used = sum(p['used'] for p in partitions)
-        total_free = sum(p['free'] for p in partitions)
+        for partition, usage in self._iter_partitions():
+            partitions.append({
+                'device': partition.device,
+                'mountpoint': partition.mountpoint,
+                'fstype': partition.fstype,
+                'total': usage.total,
+                'total_human': self._human_readable_size(usage.total),
+                'used': usage.used,
+                'used_human': self._human_readable_size(usage.used),
+                'free': usage.free,
+                'free_human': self._human_readable_size(usage.free),
+                'percent': usage.percent
+            })
+            total_space += usage.total
+            total_used += usage.used
+            total_free += usage.free
         
         return {
             'partitions': partitions,
-            'total': {
-                'total': total_space,
-                'total_human': self._human_readable_size(total_space),
-                'used': total_used,
-                'used_human': self._human_readable_size(total_used),
-                'free': total_free,
-                'free_human': self._human_readable_size(total_free),
-                'percent': (total_used / total_space * 100) if total_space > 0 else 0
-            }
+            'total': self._storage_totals(total_space, total_used, total_free)
         }
+    
+    def get_system_totals(self) -> Dict:
+        """Get combined system storage without building per-partition details"""
+        total_space = total_used = total_free = 0
+        
+        for _, usage in self._iter_partitions():
+            total_space += usage.total
+            total_used += usage.used
+            total_free += usage.free
+        
+        return self._storage_totals(total_space, total_used, total_free)
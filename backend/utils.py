@@ -0,0 +1,47 @@
+import os
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+@lru_cache(maxsize=4096)
+def human_readable_size(size_bytes: float) -> str:
+    """Convert bytes to human readable format"""
+    # Cached: partition and device sizes are formatted repeatedly across requests
+    if size_bytes < 1024:
+        return f"{size_bytes:.2f} B"
+    
+    # Each unit step is 10 bits, so the bit length picks the unit directly
+    idx = min((int(size_bytes).bit_length() - 1) // 10, len(_UNITS) - 1)
+    return f"{size_bytes / (1 << (idx * 10)):.2f} {_UNITS[idx]}"
+
+def copy_stream(src, dst, buffer_size: int = 1024 * 1024) -> int:
+    """Copy a readable stream into a writable one, reusing a single buffer"""
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    copied = 0
+    while True:
+        n = src.readinto(buf)
+        if not n:
+            return copied
+        dst.write(view[:n])
+        copied += n
+
+def drop_page_cache(f) -> None:
+    """Write back a freshly written file and evict it from the page cache"""
+    # Large uploads are not read again soon; keep them from pushing out hot pages
+    if hasattr(os, 'posix_fadvise'):
+        f.flush()
+        os.fdatasync(f.fileno())  # DONTNEED skips dirty pages, so write them back first
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+@lru_cache(maxsize=1)
+def _utc_isoformat(epoch_second: int) -> str:
+    """Render one epoch second as an ISO 8601 UTC string"""
+    return datetime.fromtimestamp(epoch_second, tz=timezone.utc).isoformat()
+
+def utc_timestamp() -> str:
+    """Current UTC time as an ISO 8601 string, at one-second resolution"""
+    # Rendered once per second and shared by every caller within it
+    return _utc_isoformat(int(time.time()))
@@ -1,11 +1,5 @@
-import sys
-import os
-
-# Add the backend directory to Python path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
-
 # Import the Flask app
-from app import app as application
+from backend.app import app as application
 
 if __name__ == "__main__":
     application.run()